@@ -0,0 +1,200 @@
+"""
+bench.py - IPFB 封包打包/解包吞吐量基准测试
+
+用 pack.pack 生成指定条目数和大小分布的合成封包，然后分别计时
+打包、解包、单条目查找 (unpack.get_entry) 和校验 (unpack.verify)，
+以 JSON 输出 MB/s、条目/s 和各阶段的峰值内存，便于做回归对比。
+
+每个阶段都在独立的子进程中运行，峰值内存互不影响。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import pack
+import unpack
+
+
+def peak_rss_kb():
+    """当前进程的峰值常驻内存 (KB)，不支持的平台返回 None"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def make_dataset(directory, entries, min_size, max_size, distribution, compressible, seed):
+    """生成合成的输入目录，返回原始数据总字节数"""
+    rng = random.Random(seed)
+    words = [bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10)))
+             for _ in range(512)]
+    hashes = set()
+    total = 0
+    os.makedirs(directory, exist_ok=True)
+    while len(hashes) < entries:
+        hash = rng.getrandbits(32)
+        if hash == 0 or hash in hashes:
+            continue
+        hashes.add(hash)
+
+        if distribution == 'lognormal':
+            size = int(rng.lognormvariate(0, 1) * (min_size + max_size) / 4)
+        else:
+            size = rng.randint(min_size, max_size)
+        size = max(min_size, min(max_size, size))
+
+        if rng.random() < compressible:
+            # 类似文本表的可压缩数据
+            data = bytearray(b'IXUD')
+            while len(data) < size:
+                data += rng.choice(words) + b' '
+            data = bytes(data[:size])
+        else:
+            data = rng.randbytes(size)
+        with open(os.path.join(directory, f'${hash:08X}'), 'wb') as f:
+            f.write(data)
+        total += size
+    return total
+
+
+def phase_pack(workdir, jobs):
+    pack.不压缩 = []
+    pack.pack(os.path.join(workdir, 'src'), os.path.join(workdir, 'bench.pak'), jobs=jobs)
+
+
+def phase_unpack(workdir, jobs):
+    unpack.name_dict = {}
+    unpack.outdir = os.path.join(workdir, 'out')
+    os.makedirs(unpack.outdir, exist_ok=True)
+    unpack.unpack(os.path.join(workdir, 'bench.pak'), jobs)
+
+
+def phase_lookup(workdir, lookups):
+    archive = os.path.join(workdir, 'bench.pak')
+    with unpack.IPFBArchive(archive) as f:
+        hashes = [entry[0] for entry in f.entries]
+    rng = random.Random(0)
+    for hash in (rng.choice(hashes) for _ in range(lookups)):
+        if unpack.get_entry(archive, f'${hash:X}') is None:
+            raise RuntimeError(f'找不到条目 ${hash:X}')
+
+
+def phase_verify(workdir, jobs):
+    problems = unpack.verify(os.path.join(workdir, 'bench.pak'), jobs)
+    if problems:
+        raise RuntimeError(f'校验失败: {problems[:5]}')
+
+
+PHASES = {
+    'pack': phase_pack,
+    'unpack': phase_unpack,
+    'lookup': phase_lookup,
+    'verify': phase_verify,
+}
+
+
+def run_phase(name, workdir, arg, queue):
+    # pack/unpack 会把日志写到当前目录，并逐个打印文件名
+    os.chdir(workdir)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        PHASES[name](workdir, arg)
+        elapsed = time.perf_counter() - start
+    queue.put((elapsed, peak_rss_kb()))
+
+
+def measure(name, workdir, arg):
+    """在子进程中运行一个阶段，返回 (耗时秒数, 峰值内存 KB)"""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=run_phase, args=(name, workdir, arg, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f'阶段 {name} 失败，退出码 {process.exitcode}')
+    return queue.get()
+
+
+def rate(amount, seconds):
+    return round(amount / seconds, 2) if seconds > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IPFB 封包打包/解包吞吐量基准测试，结果以 JSON 输出。")
+    parser.add_argument("-n", "--entries", type=int, default=2000, help="合成封包的条目数 (默认 2000)。")
+    parser.add_argument("--min-size", type=int, default=256, help="条目最小字节数 (默认 256)。")
+    parser.add_argument("--max-size", type=int, default=256 << 10, help="条目最大字节数 (默认 262144)。")
+    parser.add_argument("--distribution", choices=('uniform', 'lognormal'), default='lognormal',
+                        help="条目大小分布 (默认 lognormal)。")
+    parser.add_argument("--compressible", type=float, default=0.8,
+                        help="可压缩 (类文本) 条目所占比例，其余为随机数据 (默认 0.8)。")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="打包/解包/校验使用的线程数 (默认 1)。")
+    parser.add_argument("--lookups", type=int, default=200, help="单条目查找的次数 (默认 200)。")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子 (默认 0)。")
+    parser.add_argument("--workdir", help="工作目录 (默认使用临时目录并在结束后删除)。")
+    parser.add_argument("-o", "--output", help="把 JSON 结果写入该文件 (默认输出到标准输出)。")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix='ipfb-bench-'))
+        workdir = os.path.abspath(workdir)
+        raw_bytes = make_dataset(os.path.join(workdir, 'src'), args.entries, args.min_size, args.max_size,
+                                 args.distribution, args.compressible, args.seed)
+
+        results = {}
+        for name, arg in (('pack', args.jobs), ('unpack', args.jobs), ('lookup', args.lookups),
+                          ('verify', args.jobs)):
+            seconds, rss = measure(name, workdir, arg)
+            count = args.lookups if name == 'lookup' else args.entries
+            results[name] = {
+                'seconds': round(seconds, 4),
+                'entries_per_sec': rate(count, seconds),
+                'peak_rss_kb': rss,
+            }
+            if name != 'lookup':
+                results[name]['mb_per_sec'] = rate(raw_bytes / (1 << 20), seconds)
+            else:
+                results[name]['ms_per_lookup'] = round(seconds * 1000 / max(count, 1), 4)
+
+        archive_bytes = sum(os.path.getsize(os.path.join(workdir, name))
+                            for name in os.listdir(workdir) if re.fullmatch(r'bench\.(pak|p\d\d)', name))
+
+    report = {
+        'params': {
+            'entries': args.entries,
+            'min_size': args.min_size,
+            'max_size': args.max_size,
+            'distribution': args.distribution,
+            'compressible': args.compressible,
+            'jobs': args.jobs,
+            'lookups': args.lookups,
+            'seed': args.seed,
+        },
+        'python': sys.version.split()[0],
+        'raw_bytes': raw_bytes,
+        'archive_bytes': archive_bytes,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
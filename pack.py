@@ -1,8 +1,16 @@
 import os
-import sys
 import zlib
+import json
 import struct
+import hashlib
+import time
+import statistics
+import argparse
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from unpack import IPFBArchive, write_index_sidecar
 
 def make_file_id(lp_string):
     if lp_string[:1] == "$":
@@ -39,8 +47,10 @@ def compress_custom(file):
     with open(file, 'rb') as f:
         data = f.read()
         f.close()
+    return compress_bytes(data)
 
-    compress_data = zlib.compress(data, level=8, wbits=-15)
+def compress_bytes(data, level=8):
+    compress_data = zlib.compress(data, level=level, wbits=-15)
     z1 = bytearray()
     z1.extend(b'Z1')
     z1.extend(struct.pack('>I', len(data)))
@@ -51,6 +61,231 @@ def compress_custom(file):
     z1.extend(adler32)
     return  z1
 
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def cache_path_for(output_file):
+    return f'{os.path.splitext(output_file)[0]}.pack-cache.json'
+
+def load_pack_cache(output_file):
+    """
+    读取增量打包缓存：{文件名: [大小, mtime_ns, sha1]}。
+    缓存同时记录了生成它的 .pak 的大小和 mtime，封包被其他方式改写过时缓存作废。
+    """
+    try:
+        with open(cache_path_for(output_file), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        st = os.stat(output_file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('archive') != [st.st_size, st.st_mtime_ns]:
+        return {}
+    return cache.get('files', {})
+
+def save_pack_cache(output_file, files):
+    st = os.stat(output_file)
+    with open(cache_path_for(output_file), 'w', encoding='utf-8') as f:
+        json.dump({'archive': [st.st_size, st.st_mtime_ns], 'files': files}, f, ensure_ascii=False)
+
+def reuse_blob(previous, cache, hash, file, path, st, store):
+    """
+    文件自上次打包后未变化时，直接返回旧封包中已压缩的数据块，否则返回 None。
+    store 为 True/False 时旧数据块的存储方式必须与之一致，为 None 时不限。
+    """
+    cached = cache.get(file)
+    if previous is None or cached is None:
+        return None
+    entry = previous.find(hash)
+    if entry is None:
+        return None
+    # 大小和修改时间都没变就不再读取文件，否则比对内容 sha1
+    if cached[:2] != [st.st_size, st.st_mtime_ns] and file_sha1(path) != cached[2]:
+        return None
+    blob = previous.read(entry[1], entry[2])
+    if blob is None or (store is not None and (blob[:2] == b'Z1') == store):
+        return None
+    return bytes(blob)
+
+class VolumeWriter:
+    """
+    把数据块流式写入 .p00, .p01, ... 分卷（先写到 .tmp，commit 时替换），块与块之间按 2048 字节对齐。
+    索引中的偏移高 4 位是分卷号、低 28 位是卷内偏移，当前分卷放不下下一个数据块时换到下一个分卷。
+    """
+
+    ALIGN = 2048
+    VOLUME_SIZE = 0x10000000
+    MAX_VOLUMES = 16
+
+    def __init__(self, output_file, volume_size=VOLUME_SIZE):
+        if not 0 < volume_size <= self.VOLUME_SIZE:
+            raise ValueError(f"分卷大小必须在 1 到 0x{self.VOLUME_SIZE:X} 之间: 0x{volume_size:X}")
+        self.base = os.path.splitext(output_file)[0]
+        self.volume_size = volume_size
+        self._volume = 0
+        self._file = open(self.volume_path(0) + '.tmp', 'wb')
+        self._pos = 0
+
+    def volume_path(self, fnum):
+        return f'{self.base}.p{fnum:02d}'
+
+    def write(self, blob):
+        """写入一个数据块，返回索引中使用的偏移 (分卷号 << 28 | 卷内偏移)"""
+        if len(blob) > self.volume_size:
+            raise ValueError(f"数据块大小 0x{len(blob):X} 超过分卷大小 0x{self.volume_size:X}")
+
+        padding = (self.ALIGN - self._pos % self.ALIGN) % self.ALIGN
+        if self._pos and self._pos + padding + len(blob) > self.volume_size:
+            self._next_volume()
+            padding = 0
+        if padding:
+            self._file.write(b'\x00' * padding)
+            self._pos += padding
+        offset = self._pos
+        self._file.write(blob)
+        self._pos += len(blob)
+        return (self._volume << 28) | offset
+
+    def _next_volume(self):
+        if self._volume + 1 >= self.MAX_VOLUMES:
+            raise ValueError(f"封包超过 {self.MAX_VOLUMES} 个分卷的上限")
+        self._file.close()
+        self._volume += 1
+        self._file = open(self.volume_path(self._volume) + '.tmp', 'wb')
+        self._pos = 0
+
+    def close(self):
+        self._file.close()
+
+    def commit(self):
+        for fnum in range(self._volume + 1):
+            os.replace(self.volume_path(fnum) + '.tmp', self.volume_path(fnum))
+        # 删除上一次打包遗留的多余分卷
+        fnum = self._volume + 1
+        while os.path.exists(self.volume_path(fnum)):
+            os.remove(self.volume_path(fnum))
+            fnum += 1
+
+def file_type(head, file):
+    """按 unpack.read_prefix 的规则从前 4 字节识别类型（如 IXUD），识别不出时退回扩展名（如 TTF）"""
+    s = bytes(head[:4]).decode('utf-8', errors='ignore').replace('\x00', '')
+    if len(s) >= 3 and s.isalnum():
+        return s
+    return os.path.splitext(file)[1][1:].upper()
+
+def read_head(path, size=4):
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+TUNE_LEVELS = (1, 6, 8, 9)
+
+def tune_levels(input_dir, entries, sample=8, sample_bytes=256 << 10, min_saving=0.05, tolerance=0.01):
+    """
+    按类型抽样试压，返回 {类型: 压缩级别}，0 表示直接存储。
+    每种类型在全部文件中均匀抽取 sample 个，各取前 sample_bytes 字节用各个候选级别压缩并计时。
+    按单个文件压缩率的中位数判断，个别特别大或无法压缩的文件不会左右整个类型：
+    中位数也省不到 min_saving 时直接存储，否则在压缩率不超过最优 tolerance 的级别中选实测耗时最少的。
+    """
+    paths = {}
+    for hash, file in entries:
+        if file in 不压缩:
+            continue
+        path = os.path.join(input_dir, file)
+        paths.setdefault(file_type(read_head(path), file), []).append(path)
+
+    levels = {}
+    for kind, group in paths.items():
+        count = min(sample, len(group))
+        ratios = {level: [] for level in TUNE_LEVELS}
+        seconds = dict.fromkeys(TUNE_LEVELS, 0.0)
+        for i in range(count):
+            with open(group[i * len(group) // count], 'rb') as f:
+                data = f.read(sample_bytes)
+            if not data:
+                continue
+            for level in TUNE_LEVELS:
+                start = time.perf_counter()
+                size = len(compress_bytes(data, level))
+                seconds[level] += time.perf_counter() - start
+                ratios[level].append(size / len(data))
+        if not ratios[TUNE_LEVELS[0]]:
+            continue
+
+        medians = {level: statistics.median(ratios[level]) for level in TUNE_LEVELS}
+        best = min(medians.values())
+        if best > 1 - min_saving:
+            levels[kind] = 0
+        else:
+            candidates = [level for level in TUNE_LEVELS if medians[level] <= best * (1 + tolerance)]
+            levels[kind] = min(candidates, key=lambda level: seconds[level])
+    return levels
+
+def worth_compressing(raw, probe=64 << 10, min_saving=0.25):
+    """按类型判定为直接存储的文件先试压开头一段，明显能变小时仍然压缩"""
+    head = raw[:probe]
+    return bool(head) and len(zlib.compress(head, 1)) < len(head) * (1 - min_saving)
+
+def build_blob(input_dir, hash, file, previous, old_cache, levels=None, written=None):
+    """
+    生成一个条目要写入封包的数据块，返回 (数据块, 缓存记录, 去重键, (类型, 原始大小, 压缩耗时))；
+    可在线程池中并发调用（zlib 压缩时会释放 GIL）。
+    levels 为 tune_levels 的结果，为 None 时除不压缩列表外一律按级别 8 压缩；
+    类型判定为直接存储、但本身明显可压缩的文件 (worth_compressing) 仍按级别 8 压缩。
+    去重键为 (内容 sha1, 是否直接存储)，键已在 written 中时不再压缩，数据块返回 None。
+    """
+    path = os.path.join(input_dir, file)
+    st = os.stat(path)
+    kind = None
+    level = 0 if file in 不压缩 else 8
+    if levels is not None and level:
+        kind = file_type(read_head(path), file)
+        level = levels.get(kind, 8)
+    # 按类型直接存储的文件可能逐个退回压缩，旧数据块两种形式都可沿用
+    fallback = kind is not None and level == 0
+
+    compress_data = reuse_blob(previous, old_cache, hash, file, path, st, None if fallback else level == 0)
+    if compress_data is not None:
+        stored = compress_data[:2] != b'Z1'
+        return compress_data, old_cache[file], (old_cache[file][2], stored), (kind, old_cache[file][0], 0.0)
+
+    with open(path, 'rb') as src:
+        raw = src.read()
+    if fallback and worth_compressing(raw):
+        level = 8
+    cache_entry = [st.st_size, st.st_mtime_ns, hashlib.sha1(raw).hexdigest()]
+    key = (cache_entry[2], level == 0)
+    if written is not None and key in written:
+        return None, cache_entry, key, (kind, len(raw), 0.0)
+
+    start = time.perf_counter()
+    if  level == 0:
+        compress_data = raw
+    else:
+        compress_data =  compress_bytes(raw, level)
+    elapsed = time.perf_counter() - start
+    return compress_data, cache_entry, key, (kind, len(raw), elapsed)
+
+def print_tune_report(levels, stats):
+    """stats: {类型: [文件数, 原始大小, 写入大小, 压缩耗时]}"""
+    print(f"{'类型':<8}{'级别':>6}{'文件数':>8}{'原始大小':>14}{'写入大小':>14}{'节省':>14}{'耗时(秒)':>10}")
+    total = [0, 0, 0, 0.0]
+    for kind, (count, raw_size, size, seconds) in sorted(stats.items(), key=lambda item: str(item[0])):
+        level = '不压缩' if kind is None else ('存储' if levels.get(kind) == 0 else levels.get(kind, 8))
+        print(f"{kind or '-':<8}{level:>6}{count:>8}{raw_size:>14}{size:>14}{raw_size - size:>14}{seconds:>10.2f}")
+        total = [a + b for a, b in zip(total, (count, raw_size, size, seconds))]
+    count, raw_size, size, seconds = total
+    print(f"{'合计':<8}{'':>6}{count:>8}{raw_size:>14}{size:>14}{raw_size - size:>14}{seconds:>10.2f}")
+
+def bounded_map(pool, func, items, limit):
+    """按顺序产出 func(item) 的结果，同时最多只有 limit 个任务在途，避免结果在内存中堆积"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
 def write_int(f, value, byteorder='big'):
     f.write(value.to_bytes(4, byteorder))
 
@@ -63,62 +298,107 @@ def get_all_files(directory):
                 file_list[make_file_id(filename)] = filename
     return file_list
 
-def pack(input_dir, output_file):
+def pack(input_dir, output_file, incremental=False, volume_size=VolumeWriter.VOLUME_SIZE, jobs=1,
+         auto_level=False, dedup=True):
 
     file_list = get_all_files(input_dir)
-    data = bytearray()
+    entries = sorted(file_list.items())
     log = []
+    cache = {}
+    stats = {}
+    # 内容相同的条目共用一个数据块: (内容 sha1, 是否直接存储) → (offset, size)
+    written = {} if dedup else None
 
-    with open(output_file, 'wb') as f:
-        f.write(b'IPFB')
-        write_int(f, len(file_list))
-        write_int(f,0x800)
-        write_int(f,0x10000000)
-        
-        idx = 0
-        for hash, file in sorted(file_list.items()):
-            print(file)
-            if  file in 不压缩:
-                compress_data = open(os.path.join(input_dir, file), 'rb').read()
+    # 自动调优模式下先按类型抽样决定压缩级别
+    levels = tune_levels(input_dir, entries) if auto_level else None
+
+    # 增量模式下沿用旧封包中未变化文件的压缩数据，新封包先写到临时文件，最后再替换
+    previous = None
+    old_cache = {}
+    if incremental and os.path.exists(output_file):
+        old_cache = load_pack_cache(output_file)
+        if old_cache:
+            previous = IPFBArchive(output_file)
+
+    volumes = VolumeWriter(output_file, volume_size)
+    try:
+        with open(output_file + '.tmp', 'wb') as f:
+            f.write(b'IPFB')
+            write_int(f, len(file_list))
+            write_int(f,0x800)
+            write_int(f,volume_size)
+
+            # 压缩可以并发进行，但始终按 hash 顺序写出，输出与串行打包逐字节一致
+            if jobs > 1:
+                pool = ThreadPoolExecutor(max_workers=jobs)
+                blobs = bounded_map(pool, lambda item: build_blob(input_dir, *item, previous, old_cache, levels, written),
+                                    entries, jobs * 4)
             else:
-                compress_data =  compress_custom(os.path.join(input_dir, file))
-            
-            offset = len(data)
-            size =len (compress_data)
-            
-            data.extend(compress_data)
+                pool = None
+                blobs = (build_blob(input_dir, hash, file, previous, old_cache, levels, written) for hash, file in entries)
 
-            write_int(f, hash)
-            write_int(f, offset)
-            write_int(f, size)
-            log.append((file, hash, offset, size))
+            try:
+                for (hash, file), (compress_data, cache_entry, key, (kind, raw_size, seconds)) in zip(entries, blobs):
+                    print(file)
+                    cache[file] = cache_entry
+                    stat = stats.setdefault(kind, [0, 0, 0, 0.0])
+                    stat[0] += 1
+                    stat[1] += raw_size
+                    stat[3] += seconds
 
-            idx += 1
-            if idx == len(file_list):
-                break
+                    if written is not None and key in written:
+                        offset, size = written[key]
+                    else:
+                        offset = volumes.write(compress_data)
+                        size =len (compress_data)
+                        stat[2] += size
+                        if written is not None:
+                            written[key] = (offset, size)
 
-            data.extend( b'\x00' * ((2048 - (len(data) % 2048)) % 2048))
+                    write_int(f, hash)
+                    write_int(f, offset)
+                    write_int(f, size)
+                    log.append((file, hash, offset, size))
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+    finally:
+        volumes.close()
+        if previous is not None:
+            previous.close()
 
-    with open(f'{os.path.splitext(output_file)[0]}.p00', 'wb') as f:
-        f.write(data)
+    os.replace(output_file + '.tmp', output_file)
+    volumes.commit()
+    save_pack_cache(output_file, cache)
+    write_index_sidecar(output_file, file_list)
 
     with open('pack.log', 'w') as f:
         for file, hash, offset, size in log:
             f.write(f"{format(hash, 'X')} {format(offset, 'X')} {format(size, 'X')} {file}\n")
 
+    if auto_level:
+        print_tune_report(levels, stats)
         
 
-
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("用法: <输入目录> <输出文件>")
-    else:
-        不压缩 = ['HGRGE00.TTF','$1D93DAF0.ttcf']
-        if os.path.exists(os.path.join(sys.argv[1], 'Non-compression-list.txt')):
-            with open(os.path.join(sys.argv[1], 'Non-compression-list.txt'), 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        不压缩.append(line)
-
-        pack(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="把目录打包为 IPFB (.pak + .p00) 封包。")
+    parser.add_argument("input_dir", help="输入目录")
+    parser.add_argument("output_file", help="输出文件 (.pak)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="增量打包: 未变化的文件直接复用旧封包中的压缩数据。")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并发压缩的线程数 (默认 1)。")
+    parser.add_argument("-a", "--auto-level", action="store_true",
+                        help="按文件类型抽样试压，自动选择压缩级别或直接存储，并输出统计报告。")
+    parser.add_argument("--no-dedup", action="store_true", help="不合并内容相同的条目，每个条目各自存储一份数据。")
+    args = parser.parse_args()
+
+    不压缩 = ['HGRGE00.TTF','$1D93DAF0.ttcf']
+    if os.path.exists(os.path.join(args.input_dir, 'Non-compression-list.txt')):
+        with open(os.path.join(args.input_dir, 'Non-compression-list.txt'), 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    不压缩.append(line)
+
+    pack(args.input_dir, args.output_file, args.incremental, jobs=args.jobs, auto_level=args.auto_level,
+         dedup=not args.no_dedup)
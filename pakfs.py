@@ -0,0 +1,158 @@
+"""
+pakfs.py - IPFB 封包的只读虚拟文件系统视图
+
+用法示例:
+    from pakfs import PakFS
+
+    with PakFS('dat/tables.pak') as fs:
+        print(fs.listdir('jpn'))
+        with fs.open('jpn\\Files.tbl') as f:
+            data = f.read()
+
+文件名通过 list.txt 解析（与 unpack.py 相同），不在 list.txt 中的条目以 $HASH 命名。
+路径分隔符 \\ 和 / 均可。条目在 open() 时才解压，解压结果放入按字节数限制大小的 LRU 缓存。
+"""
+
+import io
+import os
+import stat
+import struct
+import threading
+from collections import OrderedDict
+
+from unpack import IPFBArchive, NameIndex, decode_entry, file_id_from_name
+
+
+class PakFS:
+    """对已打开的 IPFB 封包提供 listdir/open/stat 等类似 os 模块的只读接口"""
+
+    def __init__(self, path, list_path='list.txt', cache_size=64 << 20):
+        self.archive = IPFBArchive(path)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+        names = NameIndex.load(list_path) if os.path.exists(list_path) else {}
+        self._entries = {}
+        # 目录 → 子项名称集合，根目录为 ''
+        self._dirs = {'': set()}
+        for entry in self.archive.entries:
+            hash = entry[0]
+            self._entries[hash] = entry
+            name = names.get(hash, f"${hex(hash)[2:].upper()}")
+            parent = ''
+            for part in name.split('\\')[:-1]:
+                self._dirs[parent].add(part)
+                parent = self._join(parent, part)
+                self._dirs.setdefault(parent, set())
+            self._dirs[parent].add(name.split('\\')[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+        self.archive.close()
+
+    @staticmethod
+    def _normpath(path):
+        return path.replace('/', '\\').strip('\\')
+
+    @staticmethod
+    def _join(parent, name):
+        return f'{parent}\\{name}' if parent else name
+
+    def _entry(self, path):
+        try:
+            entry = self._entries.get(file_id_from_name(self._normpath(path)))
+        except ValueError:
+            entry = None
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry
+
+    def listdir(self, path=''):
+        path = self._normpath(path)
+        if path not in self._dirs:
+            if self.isfile(path):
+                raise NotADirectoryError(path)
+            raise FileNotFoundError(path)
+        return sorted(self._dirs[path])
+
+    def isdir(self, path):
+        return self._normpath(path) in self._dirs
+
+    def isfile(self, path):
+        try:
+            self._entry(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def stat(self, path):
+        """返回 os.stat_result；文件的 st_size 为解压后的大小（取自 Z1 头，无需解压）"""
+        if self.isdir(path):
+            return os.stat_result((stat.S_IFDIR | 0o555, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+        hash, offset, size = self._entry(path)
+        p_data = self.archive.read(offset, size)
+        if p_data is None:
+            raise FileNotFoundError(path)
+        with p_data:
+            if p_data[:2] == b'Z1' and size >= 12:
+                size = struct.unpack_from('>I', p_data, 2)[0]
+        return os.stat_result((stat.S_IFREG | 0o444, hash, 0, 1, 0, 0, size, 0, 0, 0))
+
+    def read_bytes(self, path):
+        """读取并解压一个条目，结果经过 LRU 缓存"""
+        hash, offset, size = self._entry(path)
+        with self._lock:
+            data = self._cache.get(hash)
+            if data is not None:
+                self._cache.move_to_end(hash)
+                return data
+
+        p_data = self.archive.read(offset, size)
+        if p_data is None:
+            raise FileNotFoundError(path)
+        with p_data:
+            data = decode_entry(p_data)
+            if data is None:
+                raise OSError(f"解压失败: {path}")
+            data = bytes(data)
+
+        with self._lock:
+            if len(data) <= self.cache_size and hash not in self._cache:
+                self._cache[hash] = data
+                self._cache_bytes += len(data)
+                while self._cache_bytes > self.cache_size:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return data
+
+    def open(self, path, mode='rb', encoding=None):
+        """以只读方式打开条目，'rb' 返回 BytesIO，'r' 返回按 encoding 解码的文本流"""
+        if mode not in ('r', 'rb'):
+            raise ValueError(f"只支持只读模式: {mode}")
+        stream = io.BytesIO(self.read_bytes(path))
+        if mode == 'r':
+            return io.TextIOWrapper(stream, encoding=encoding or 'utf-8')
+        return stream
+
+    def walk(self, top=''):
+        """与 os.walk 相同，产出 (目录, 子目录列表, 文件列表)"""
+        top = self._normpath(top)
+        dirs, files = [], []
+        for name in self.listdir(top):
+            (dirs if self._join(top, name) in self._dirs else files).append(name)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(self._join(top, name))
@@ -0,0 +1,192 @@
+"""
+recover.py - 根据 make_file_id 为未知的 $HASH 条目找回文件名
+
+从 list.txt 中已知的文件名挖掘目录 (jpn\\, eng\\, ...)、扩展名、前缀 (GP_, VOICE_, ...)、单词和数字模式，
+生成候选名称，用 unpack.make_file_ids 批量计算 hash，与封包中 list.txt 无法解析的 hash 比对。
+候选在多个进程中并行计算，进度输出到标准错误。
+
+模板语法 (--template):
+    {num:N}   N 位补零的数字 (0..10^N-1)
+    {word}    挖掘出的单词及 --wordlist 中的单词
+    {prefix}  挖掘出的前缀 (如 GP_)
+    {dir}     挖掘出的目录 (如 jpn\\)
+    {ext}     挖掘出的扩展名 (如 .tbl)
+    {alpha}   单个大写字母 A-Z
+例: recover.py dat\\tables.pak --template "{dir}SUBTITLE_RT{num:2}{alpha}{ext}"
+
+同一个 hash 可能对应多个候选名称（hash 只有 32 位），全部列出由人工确认。
+"""
+
+import os
+import re
+import sys
+import time
+import string
+import argparse
+import itertools
+import multiprocessing
+
+from unpack import IPFBArchive, NameIndex, make_file_ids
+
+
+PLACEHOLDER = re.compile(r'\{(num|word|prefix|dir|ext|alpha)(?::(\d+))?\}')
+
+
+def mine(names):
+    """从已知文件名中挖掘 目录/扩展名/前缀/单词/数字模式"""
+    vocab = {'dir': set(), 'ext': set(), 'prefix': set(), 'word': set()}
+    patterns = set()
+    basenames = set()
+    for name in names:
+        parts = name.split('\\')
+        for i in range(1, len(parts)):
+            vocab['dir'].add('\\'.join(parts[:i]) + '\\')
+        base = parts[-1]
+        basenames.add(base)
+        stem, ext = os.path.splitext(base)
+        if ext:
+            vocab['ext'].add(ext)
+        match = re.match(r'[A-Za-z]+_', stem)
+        if match:
+            vocab['prefix'].add(match.group())
+        vocab['word'].update(word for word in re.split(r'[_\W\d]+', stem) if word)
+        if '{' not in name and '}' not in name and re.search(r'\d', name):
+            patterns.add(re.sub(r'\d+', lambda m: f'{{num:{len(m.group())}}}', name))
+    return {key: sorted(values) for key, values in vocab.items()}, sorted(patterns), sorted(basenames)
+
+
+def expand(template, vocab, max_digits):
+    """展开一个模板，产出所有候选名称；数字位数总和超过 max_digits 的模板跳过"""
+    pieces = PLACEHOLDER.split(template)
+    # split 的结果为 文本, 类型, 宽度, 文本, 类型, 宽度, ..., 文本
+    literals = pieces[0::3]
+    fields = list(zip(pieces[1::3], pieces[2::3]))
+    if sum(int(width or 1) for kind, width in fields if kind == 'num') > max_digits:
+        return
+
+    choices = []
+    for kind, width in fields:
+        if kind == 'num':
+            width = int(width or 1)
+            choices.append([f'{i:0{width}d}' for i in range(10 ** width)])
+        elif kind == 'alpha':
+            choices.append(string.ascii_uppercase)
+        else:
+            choices.append(vocab[kind])
+
+    for values in itertools.product(*choices):
+        yield ''.join(itertools.chain.from_iterable(itertools.zip_longest(literals, values, fillvalue='')))
+
+
+def candidates(templates, vocab, patterns, basenames, strategies, max_digits):
+    if 'patterns' in strategies:
+        # 已知名称中的数字换成其他编号，如 VOICE_TCAF_{num:3}
+        for pattern in patterns:
+            yield from expand(pattern, vocab, max_digits)
+    if 'dirs' in strategies:
+        # 已知文件名放到其他目录下，如 eng\X → jpn\X
+        for base in basenames:
+            yield base
+            for directory in vocab['dir']:
+                yield directory + base
+    for template in templates:
+        yield from expand(template, vocab, max_digits)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_targets = frozenset()
+
+
+def _init_worker(targets):
+    global _targets
+    _targets = targets
+
+
+def match_chunk(chunk):
+    """返回 (本批候选数, [(hash, 名称)])"""
+    return len(chunk), [(file_id, name) for file_id, name in zip(make_file_ids(chunk), chunk) if file_id in _targets]
+
+
+def unresolved_hashes(archives, names):
+    targets = set()
+    for path in archives:
+        with IPFBArchive(path) as archive:
+            targets.update(hash for hash, offset, size in archive.entries if hash not in names)
+    return targets
+
+
+def recover(targets, candidate_iter, jobs=None, chunk_size=50000, progress=True):
+    """并行比对候选名称，返回 {hash: {小写名称: 名称}}（hash 不区分大小写，大小写不同的同一名称只保留一个）"""
+    found = {}
+    tested = 0
+    start = last = time.perf_counter()
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(frozenset(targets),)) as pool:
+        for count, matches in pool.imap_unordered(match_chunk, chunked(candidate_iter, chunk_size)):
+            tested += count
+            for file_id, name in matches:
+                found.setdefault(file_id, {}).setdefault(name.lower(), name)
+            now = time.perf_counter()
+            if progress and now - last >= 1:
+                last = now
+                print(f"\r已测试 {tested} 个候选 ({tested / (now - start):.0f}/秒)，"
+                      f"找回 {len(found)}/{len(targets)} 个 hash", end='', file=sys.stderr, flush=True)
+    if progress:
+        elapsed = time.perf_counter() - start
+        print(f"\r已测试 {tested} 个候选，用时 {elapsed:.1f} 秒，找回 {len(found)}/{len(targets)} 个 hash",
+              file=sys.stderr)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="根据已知文件名生成候选名称，找回封包中未知 $HASH 条目的文件名。")
+    parser.add_argument("archives", nargs='*', help="要找回名称的封包 (.pak)，取其中 list.txt 无法解析的 hash")
+    parser.add_argument("--hashes", help="额外的目标 hash 列表文件，每行一个十六进制 hash (可带 $ 前缀)")
+    parser.add_argument("-l", "--list", default='list.txt', help="已知文件名列表 (默认 list.txt)")
+    parser.add_argument("-t", "--template", action="append", default=[], help="候选名称模板，可重复指定")
+    parser.add_argument("-w", "--wordlist", action="append", default=[], help="额外的单词表文件，每行一个单词")
+    parser.add_argument("--strategy", default='patterns,dirs',
+                        help="启用的挖掘策略，逗号分隔: patterns (替换编号), dirs (换目录)；留空只用模板 (默认 patterns,dirs)")
+    parser.add_argument("--max-digits", type=int, default=4, help="单个模板中数字位数总和的上限 (默认 4)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="进程数 (默认使用全部 CPU 核心)")
+    parser.add_argument("-o", "--output", help="把找回的名称写入该文件 (每行一个，可追加到 list.txt)")
+    args = parser.parse_args()
+
+    names = NameIndex.load(args.list)
+    targets = unresolved_hashes(args.archives, names)
+    if args.hashes:
+        with open(args.hashes, 'r', encoding='utf-8') as f:
+            targets.update(int(line.strip().lstrip('$').split('.')[0], 16) for line in f if line.strip())
+    if not targets:
+        print("没有需要找回名称的 hash。")
+        return
+
+    vocab, patterns, basenames = mine(name for hash, name in names.items())
+    for path in args.wordlist:
+        with open(path, 'r', encoding='utf-8') as f:
+            vocab['word'] = sorted(set(vocab['word']).union(line.strip() for line in f if line.strip()))
+
+    strategies = {s.strip() for s in args.strategy.split(',') if s.strip()}
+    found = recover(targets, candidates(args.template, vocab, patterns, basenames, strategies, args.max_digits),
+                    args.jobs)
+
+    lines = []
+    for file_id in sorted(found):
+        for name in sorted(found[file_id].values()):
+            lines.append(name)
+            note = ' (hash 冲突，需确认)' if len(found[file_id]) > 1 else ''
+            print(f"{file_id:08X} {name}{note}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.writelines(f'{line}\n' for line in lines)
+
+
+if __name__ == "__main__":
+    main()
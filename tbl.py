@@ -2,8 +2,13 @@
 
 import os
 import sys
+import json
 import struct
+import hashlib
+import bisect
 import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 def read_int(f, address=None):
     """从文件对象读取一个整数 (4 字节, 大端序)"""
@@ -14,45 +19,86 @@ def read_int(f, address=None):
         raise EOFError("读取整数时文件意外结束。")
     return int.from_bytes(data, 'big')
 
+def read_int_array(data, offset, count):
+    """从 data 的 offset 处一次性解码 count 个大端 uint32，返回 array('I')"""
+    end = offset + count * 4
+    if end > len(data):
+        raise EOFError("读取整数时文件意外结束。")
+    values = array('I', data[offset:end])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
 def write_int(f, value):
     """将一个整数 (4 字节, 大端序) 写入文件对象"""
     f.write(struct.pack('>I', value))
 
-def extract_utf16be(f, address=None):
+class StringArea:
     """
-    从文件对象读取一个以 null 结尾的 UTF-16BE 字符串。
-    二进制文件中的指针是 UTF-16BE 字单位，因此 address 应该是字节偏移量。
+    一次性解码字符区中的 UTF-16BE 字符串。
+    在字对齐的位置扫描所有 \x00\x00 结束符，建立 字节偏移量 → 字符串 的映射，
+    指针直接查表；指向字符串中间的指针解码到其后的第一个结束符并缓存。
     """
-    if address is None or address < 0:
-        # 处理无效或空指针，返回空字符串
-        return ""
 
-    original_pos = f.tell()
-    try:
-        f.seek(address)
-        buffer = bytearray()
-        while True:
-            two_bytes = f.read(2)
-            if len(two_bytes) < 2 or two_bytes == b'\x00\x00':
-                break
-            buffer.extend(two_bytes)
-        return buffer.decode('utf-16be', errors='ignore')
-    finally:
-        # 恢复文件位置
-        f.seek(original_pos)
-
-def extract_tbl(input_bin, output_xdi):
+    def __init__(self, data, start):
+        self.view = memoryview(data)
+        self.size = len(data)
+        # 字对齐 (相对文件起始) 的结束符位置，升序
+        self.terminators = []
+        pos = data.find(b'\x00\x00', start)
+        while pos != -1:
+            if pos % 2:
+                pos = data.find(b'\x00\x00', pos + 1)
+                continue
+            self.terminators.append(pos)
+            pos = data.find(b'\x00\x00', pos + 2)
+
+        self.strings = {}
+        pos = start
+        for end in self.terminators:
+            self.strings[pos] = self._decode(pos, end)
+            pos = end + 2
+        if pos < self.size:
+            # 最后一个字符串没有结束符，读到文件末尾
+            self.strings[pos] = self._decode(pos, self._eof(pos))
+
+    def _eof(self, address):
+        # 与逐字读取一致：末尾不足 2 字节的部分丢弃
+        return address + (self.size - address) // 2 * 2
+
+    def _decode(self, start, end):
+        return str(self.view[start:end], 'utf-16be', errors='ignore')
+
+    def get(self, address):
+        """
+        返回从字节偏移量 address 开始、以 null 结尾的字符串。
+        无效或越过文件末尾的指针返回空字符串。
+        """
+        if address is None or address < 0 or address >= self.size:
+            # 处理无效或空指针，返回空字符串
+            return ""
+        string = self.strings.get(address)
+        if string is None:
+            i = bisect.bisect_left(self.terminators, address)
+            end = self.terminators[i] if i < len(self.terminators) else self._eof(address)
+            string = self.strings[address] = self._decode(address, end)
+        return string
+
+def extract_tbl(input_bin, output_xdi, log=print):
     """
     根据修正结构从 .tbl 或 .IXUD 二进制文件提取数据到 .xdi 文本文件。
+    错误和警告通过 log 输出，成功返回 True，失败返回 False。
     """
-    print(f"正在提取: {input_bin} -> {output_xdi}")
     try:
         with open(input_bin, 'rb') as f:
+            # 整个文件一次读入，索引表按列批量解码
+            data = f.read()
+
             # 读取文件头
-            file_header = f.read(4)
+            file_header = data[:4]
             if file_header != b'IXUD':
-                print(f"错误: {input_bin} 的文件头无效: {file_header}。应为 b'IXUD'。")
-                return
+                log(f"错误: {input_bin} 的文件头无效: {file_header}。应为 b'IXUD'。")
+                return False
 
             # 根据新结构计算各部分的起始位置
             file_header_size = 4
@@ -62,47 +108,38 @@ def extract_tbl(input_bin, output_xdi):
             idx1_entry_size = 16 # hash + pointer + param1 + param2 (4*4 字节)
 
             # 读取索引表 1 数量
-            idx1_count = read_int(f, idx1_count_pos)
+            idx1_count = read_int_array(data, idx1_count_pos, 1)[0]
 
-            # 读取索引表 1 条目
-            idx1_entries = []
-            f.seek(idx1_start_pos)
-            for _ in range(idx1_count):
-                hash_val = read_int(f)
-                string_pointer_word = read_int(f) # 这个指针是字单位
-                param1 = read_int(f)
-                param2 = read_int(f)
-                idx1_entries.append((hash_val, string_pointer_word, param1, param2))
+            # 读取索引表 1 条目: hash, 字符串指针 (字单位), param1, param2
+            idx1_table = read_int_array(data, idx1_start_pos, idx1_count * 4)
+            idx1_entries = list(zip(idx1_table[0::4], idx1_table[1::4], idx1_table[2::4], idx1_table[3::4]))
 
             # 计算索引表 2 数量的位置
             idx2_count_pos = idx1_start_pos + idx1_count * idx1_entry_size
 
             # 读取索引表 2 数量
-            idx2_count = read_int(f, idx2_count_pos)
+            idx2_count = read_int_array(data, idx2_count_pos, 1)[0]
             idx2_count_size = 4
             idx2_start_pos = idx2_count_pos + idx2_count_size
 
-            # 读取索引表 2 条目
-            idx2_entries = []
+            # 读取索引表 2 条目: hash, pointer1, pointer2 (字单位)
             idx2_entry_size = 12 # hash + pointer1 + pointer2 (3*4 字节)
-            f.seek(idx2_start_pos)
-            for _ in range(idx2_count):
-                hash_val = read_int(f)
-                pointer1_word = read_int(f) # 这个指针是字单位
-                pointer2_word = read_int(f) # 这个指针是字单位
-                idx2_entries.append((hash_val, pointer1_word, pointer2_word))
+            idx2_table = read_int_array(data, idx2_start_pos, idx2_count * 3)
+            idx2_entries = list(zip(idx2_table[0::3], idx2_table[1::3], idx2_table[2::3]))
 
             # 读取字符区大小 (字单位) 并计算字符区起始位置 (字节单位)
             string_area_size_pos = idx2_start_pos + idx2_count * idx2_entry_size
-            string_area_size_words = read_int(f, string_area_size_pos)
+            string_area_size_words = read_int_array(data, string_area_size_pos, 1)[0]
             string_area_start_bytes = string_area_size_pos + 4
 
+            strings = StringArea(data, string_area_start_bytes)
+
             # 提取索引表 1 的字符串
             idx1_data = []
             for hash_val, string_pointer_word, param1, param2 in idx1_entries:
                  # 将字指针转换为相对于文件起始位置的字节偏移量
                 string_byte_offset = string_area_start_bytes + string_pointer_word * 2
-                string_data = extract_utf16be(f, string_byte_offset)
+                string_data = strings.get(string_byte_offset)
                 idx1_data.append((hash_val, string_pointer_word, param1, param2, string_data))
 
             # 提取索引表 2 的字符串
@@ -112,8 +149,8 @@ def extract_tbl(input_bin, output_xdi):
                 string1_byte_offset = string_area_start_bytes + pointer1_word * 2
                 string2_byte_offset = string_area_start_bytes + pointer2_word * 2
 
-                string1_data = extract_utf16be(f, string1_byte_offset)
-                string2_data = extract_utf16be(f, string2_byte_offset)
+                string1_data = strings.get(string1_byte_offset)
+                string2_data = strings.get(string2_byte_offset)
                 idx2_data.append((hash_val, pointer1_word, pointer2_word, string1_data, string2_data))
 
         # 将数据写入 .xdi 文件
@@ -133,18 +170,22 @@ def extract_tbl(input_bin, output_xdi):
                 output_file.write(f"{string2_data}\n")
 
     except FileNotFoundError:
-        print(f"错误: 未找到输入文件: {input_bin}")
+        log(f"错误: 未找到输入文件: {input_bin}")
+        return False
     except EOFError as e:
-        print(f"读取文件 {input_bin} 时出错: {e}")
+        log(f"读取文件 {input_bin} 时出错: {e}")
+        return False
     except Exception as e:
-        print(f"提取 {input_bin} 时发生未知错误: {e}")
+        log(f"提取 {input_bin} 时发生未知错误: {e}")
+        return False
+    return True
 
 
-def write_tbl(input_xdi, output_bin):
+def write_tbl(input_xdi, output_bin, log=print):
     """
     根据修正结构从 .xdi 文本文件构建 .tbl 或 .IXUD 二进制文件。
+    错误和警告通过 log 输出，成功返回 True，失败返回 False。
     """
-    print(f"正在构建: {input_xdi} -> {output_bin}")
     idx1_entries_parsed = []
     idx2_entries_parsed = []
     idx1_count_header = 0
@@ -162,11 +203,11 @@ def write_tbl(input_xdi, output_bin):
                     idx2_count_header = int(header_parts[1])
                     string_area_size_words_header = int(header_parts[2]) # 这个值仅供参考，实际大小会重新计算
                 except ValueError:
-                     print(f"错误: {input_xdi} 中的头部计数格式无效。")
-                     return
+                     log(f"错误: {input_xdi} 中的头部计数格式无效。")
+                     return False
             else:
-                 print(f"错误: {input_xdi} 中的头部行格式无效。应为 '<索引表1数量> <索引表2数量> <字符串区大小（字单位）>'。")
-                 return
+                 log(f"错误: {input_xdi} 中的头部行格式无效。应为 '<索引表1数量> <索引表2数量> <字符串区大小（字单位）>'。")
+                 return False
 
 
             # 读取条目
@@ -183,11 +224,11 @@ def write_tbl(input_xdi, output_bin):
                             string_data = f.readline().strip()
                             idx1_entries_parsed.append((hash_val, param1, param2, string_data))
                         except ValueError:
-                             print(f"错误: {input_xdi} 中索引表 1 条目数据格式无效: {current_line}")
-                             return
+                             log(f"错误: {input_xdi} 中索引表 1 条目数据格式无效: {current_line}")
+                             return False
                     else:
-                         print(f"错误: 索引表 1 条目标题格式无效: {current_line}")
-                         return
+                         log(f"错误: 索引表 1 条目标题格式无效: {current_line}")
+                         return False
                 elif current_line.startswith("#"): # 索引表 2 条目
                      parts = current_line[1:].strip().split()
                      if len(parts) == 3: # hash, offset1, offset2
@@ -199,25 +240,25 @@ def write_tbl(input_xdi, output_bin):
                              string2_data = f.readline().strip()
                              idx2_entries_parsed.append((hash_val, string1_data, string2_data))
                          except ValueError:
-                             print(f"错误: {input_xdi} 中索引表 2 条目哈希或偏移格式无效: {current_line}")
-                             return
+                             log(f"错误: {input_xdi} 中索引表 2 条目哈希或偏移格式无效: {current_line}")
+                             return False
                      else:
-                         print(f"错误: 索引表 2 条目标题格式无效: {current_line}")
-                         return
+                         log(f"错误: 索引表 2 条目标题格式无效: {current_line}")
+                         return False
                 else:
                     # 忽略空行或不符合预期格式的行
                     if current_line: # 只在非空行时警告
-                         print(f"警告: 跳过 {input_xdi} 中无法识别的行: {current_line}")
+                         log(f"警告: 跳过 {input_xdi} 中无法识别的行: {current_line}")
 
                 current_line = f.readline().strip()
 
         # 验证解析的条目数量是否与头部计数匹配 (可选，但推荐)
         if len(idx1_entries_parsed) != idx1_count_header:
-            print(f"警告: 解析的索引表 1 条目数量 ({len(idx1_entries_parsed)}) 与头部计数 ({idx1_count_header}) 不匹配。使用解析数量。")
+            log(f"警告: 解析的索引表 1 条目数量 ({len(idx1_entries_parsed)}) 与头部计数 ({idx1_count_header}) 不匹配。使用解析数量。")
             # idx1_count_header = len(idx1_entries_parsed) # 不更新头部计数，因为头部计数是读取的原始值
 
         if len(idx2_entries_parsed) != idx2_count_header:
-            print(f"警告: 解析的索引表 2 条目数量 ({len(idx2_entries_parsed)}) 与头部计数 ({idx2_count_header}) 不匹配。使用解析数量。")
+            log(f"警告: 解析的索引表 2 条目数量 ({len(idx2_entries_parsed)}) 与头部计数 ({idx2_count_header}) 不匹配。使用解析数量。")
             # idx2_count_header = len(idx2_entries_parsed) # 不更新头部计数
 
 
@@ -309,9 +350,134 @@ def write_tbl(input_xdi, output_bin):
             f.write(strings_data)
 
     except FileNotFoundError:
-        print(f"错误: 未找到输入文件: {input_xdi}")
+        log(f"错误: 未找到输入文件: {input_xdi}")
+        return False
     except Exception as e:
-        print(f"构建 {input_xdi} 时发生未知错误: {e}")
+        log(f"构建 {input_xdi} 时发生未知错误: {e}")
+        return False
+    return True
+
+
+def convert(task):
+    """在工作进程中转换一个文件，返回 (输入路径, 是否成功, 错误/警告消息列表)"""
+    mode, input_file, output_file = task
+    messages = []
+    ok = (extract_tbl if mode == 'extract' else write_tbl)(input_file, output_file, log=messages.append)
+    return input_file, ok, messages
+
+
+def run_tasks(tasks, jobs):
+    """
+    转换目录模式下收集到的所有文件，返回失败的输入文件路径集合。
+    jobs > 1 时使用进程池，各文件的错误/警告在结束后统一汇总输出。
+    """
+    failures = []
+    warnings = []
+    if jobs <= 1:
+        for mode, input_file, output_file in tasks:
+            action = "正在提取" if mode == 'extract' else "正在构建"
+            print(f"{action}: {input_file} -> {output_file}")
+            ok = (extract_tbl if mode == 'extract' else write_tbl)(input_file, output_file)
+            if not ok:
+                failures.append((input_file, []))
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            for input_file, ok, messages in executor.map(convert, tasks, chunksize=16):
+                if not ok:
+                    failures.append((input_file, messages))
+                elif messages:
+                    warnings.append((input_file, messages))
+
+        for title, results in (("警告", warnings), ("失败", failures)):
+            if results:
+                print(f"{title} ({len(results)} 个文件):")
+                for input_file, messages in results:
+                    print(f"  {input_file}")
+                    for message in messages:
+                        print(f"    {message}")
+
+    print(f"完成: 共 {len(tasks)} 个文件，成功 {len(tasks) - len(failures)} 个，失败 {len(failures)} 个。")
+    return {input_file for input_file, messages in failures}
+
+
+BUILD_CACHE_SUFFIX = '.tbl-build-cache.json'
+BUILD_CACHE_VERSION = 1
+
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def build_cache_path(output_dir):
+    """构建缓存放在输出目录旁边 (<输出目录>.tbl-build-cache.json)，不混入之后要打包的目录树"""
+    return os.path.abspath(output_dir) + BUILD_CACHE_SUFFIX
+
+
+def load_build_cache(output_dir):
+    """
+    读取构建缓存：{输出文件相对路径: [.xdi 的 sha1, 输出大小, 输出 mtime_ns, 输出的 sha1]}。
+    版本不符或无法读取时视为空。
+    """
+    try:
+        with open(build_cache_path(output_dir), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != BUILD_CACHE_VERSION:
+        return {}
+    return cache.get('files', {})
+
+
+def save_build_cache(output_dir, files):
+    path = build_cache_path(output_dir)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': BUILD_CACHE_VERSION, 'files': files}, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def build_unchanged(cached, xdi_sha1, output_bin):
+    """.xdi 内容未变且输出文件仍是上次构建的结果时返回 True"""
+    if cached is None or cached[0] != xdi_sha1:
+        return False
+    try:
+        st = os.stat(output_bin)
+    except OSError:
+        return False
+    # 大小和修改时间都没变就不再读取输出文件，否则比对内容 sha1
+    return cached[1:3] == [st.st_size, st.st_mtime_ns] or file_sha1(output_bin) == cached[3]
+
+
+def incremental_build(tasks, output_dir, jobs, force=False):
+    """
+    只重新构建 .xdi 有变化 (或输出被改动/删除) 的文件，返回失败的输入文件集合。
+    force 为 True 时全部重新构建。构建成功的文件写回缓存，失败的从缓存中移除。
+    """
+    cache = load_build_cache(output_dir)
+    pending = []
+    hashes = {}
+    for task in tasks:
+        mode, input_xdi, output_bin = task
+        key = os.path.relpath(output_bin, output_dir).replace(os.sep, '/')
+        hashes[key] = file_sha1(input_xdi)
+        if force or not build_unchanged(cache.get(key), hashes[key], output_bin):
+            pending.append((key, task))
+
+    skipped = len(tasks) - len(pending)
+    if skipped:
+        print(f"跳过 {skipped} 个未变化的文件。")
+    if not pending:
+        return set()
+
+    failed = run_tasks([task for key, task in pending], jobs)
+    for key, (mode, input_xdi, output_bin) in pending:
+        if input_xdi in failed:
+            cache.pop(key, None)
+            continue
+        st = os.stat(output_bin)
+        cache[key] = [hashes[key], st.st_size, st.st_mtime_ns, file_sha1(output_bin)]
+    save_build_cache(output_dir, cache)
+    return failed
 
 
 if __name__ == "__main__":
@@ -325,11 +491,16 @@ if __name__ == "__main__":
     # 添加位置参数，用于输入和输出路径
     parser.add_argument("input_path", help="输入文件 (.tbl/.IXUD 用于 -e, .xdi 用于 -w) 或包含它们的目录。")
     parser.add_argument("output_path", help="输出文件 (.xdi 用于 -e, .tbl/.IXUD 用于 -w) 或输出文件的目录。")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="目录模式下并行转换的进程数 (默认 1)。")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help=f"构建模式: 忽略构建缓存 (<输出目录>{BUILD_CACHE_SUFFIX})，重新构建全部文件。")
 
     args = parser.parse_args()
 
     input_path = args.input_path
     output_path = args.output_path
+    tasks = []
+    failed = False
 
     # 根据解析到的模式执行相应的操作
     if args.extract: # 提取模式
@@ -344,7 +515,7 @@ if __name__ == "__main__":
                     if file.endswith('.tbl') or file.endswith('.IXUD'):
                         input_bin_path = os.path.join(root, file)
                         output_xdi_path = os.path.join(output_root, f'{os.path.splitext(file)[0]}.xdi')
-                        extract_tbl(input_bin_path, output_xdi_path)
+                        tasks.append(('extract', input_bin_path, output_xdi_path))
         elif os.path.isfile(input_path) and (input_path.endswith('.tbl') or input_path.endswith('.IXUD')):
             if os.path.isdir(output_path):
                  # 输出到输出目录下的文件，使用 .xdi 扩展名
@@ -355,9 +526,11 @@ if __name__ == "__main__":
                  output_dir = os.path.dirname(output_xdi_path)
                  if output_dir and not os.path.exists(output_dir):
                      os.makedirs(output_dir, exist_ok=True)
-            extract_tbl(input_path, output_xdi_path)
+            print(f"正在提取: {input_path} -> {output_xdi_path}")
+            failed = not extract_tbl(input_path, output_xdi_path)
         else:
             print("提取模式输入路径无效。请提供一个 .tbl 或 .IXUD 文件或包含它们的目录。")
+            failed = True
 
     elif args.write: # 构建模式
         if os.path.isdir(input_path):
@@ -374,7 +547,7 @@ if __name__ == "__main__":
                         base_name = os.path.splitext(file)[0]
                         suffix = 'IXUD' if base_name.startswith('$') else 'tbl'
                         output_bin_path = os.path.join(output_root, f'{base_name}.{suffix}')
-                        write_tbl(input_xdi_path, output_bin_path)
+                        tasks.append(('write', input_xdi_path, output_bin_path))
         elif os.path.isfile(input_path) and input_path.endswith('.xdi'):
             if os.path.isdir(output_path):
                  # 输出到输出目录下的文件，使用确定的扩展名
@@ -387,6 +560,17 @@ if __name__ == "__main__":
                  output_dir = os.path.dirname(output_bin_path)
                  if output_dir and not os.path.exists(output_dir):
                      os.makedirs(output_dir, exist_ok=True)
-            write_tbl(input_path, output_bin_path)
+            print(f"正在构建: {input_path} -> {output_bin_path}")
+            failed = not write_tbl(input_path, output_bin_path)
+        else:
+            print("构建模式输入路径无效。请提供一个 .xdi 文件或包含它们的目录。")
+            failed = True
+
+    if tasks:
+        if args.write:
+            # 目录构建模式按内容 hash 跳过未变化的文件
+            failed = bool(incremental_build(tasks, output_path, args.jobs, args.force))
         else:
-            print("构建模式输入路径无效。请提供一个 .xdi 文件或包含它们的目录。")
\ No newline at end of file
+            failed = bool(run_tasks(tasks, args.jobs))
+    if failed:
+        sys.exit(1)
\ No newline at end of file
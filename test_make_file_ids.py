@@ -0,0 +1,38 @@
+"""
+test_make_file_ids.py - 确认 make_file_ids 与逐个调用 make_file_id 的结果逐位一致
+
+用 list.txt 中的全部名称比对 NumPy 路径和无 NumPy 时的退回路径。
+可直接运行 (python test_make_file_ids.py)，也可用 pytest 运行。
+"""
+
+import os
+
+import unpack
+from unpack import make_file_id, make_file_ids
+
+LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'list.txt')
+
+
+def load_names():
+    with open(LIST_PATH, 'r', encoding='utf-8') as f:
+        return [name for name in (line.strip().rsplit('+', 1)[-1] for line in f) if name]
+
+
+def test_matches_make_file_id():
+    names = load_names()
+    assert make_file_ids(names) == [make_file_id(name) for name in names]
+
+
+def test_matches_without_numpy():
+    names = load_names()
+    np, unpack.np = unpack.np, None
+    try:
+        assert make_file_ids(names) == [make_file_id(name) for name in names]
+    finally:
+        unpack.np = np
+
+
+if __name__ == "__main__":
+    test_matches_make_file_id()
+    test_matches_without_numpy()
+    print(f"make_file_ids 与 make_file_id 结果一致 ({len(load_names())} 个名称)")
@@ -1,21 +1,45 @@
+import io
 import os
 import sys
+import mmap
 import zlib
+import re
+import json
+import fnmatch
+import hashlib
+import struct
+import threading
+import argparse
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def read_prefix(buf, filename):
-    if filename[:1] != "$":
-        full_filename = os.path.join(outdir, filename)
-    else:
-        try:
-            s = buf[:4].decode('utf-8', errors='ignore').replace('\x00', '')
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-            if len(s) >= 3 and s.isalnum():
-                new_filename = f'{filename}.{s}'
-            else:
-                new_filename = filename
-            full_filename = os.path.join(outdir, new_filename)
-        except:
-            full_filename = os.path.join(outdir, filename)
+def sniff_magic(buf):
+    """从前 4 字节识别文件类型（如 IXUD），识别不出时返回 None"""
+    try:
+        s = bytes(buf[:4]).decode('utf-8', errors='ignore').replace('\x00', '')
+    except:
+        return None
+    if len(s) >= 3 and s.isalnum():
+        return s
+    return None
+
+def prefixed_name(buf, filename):
+    """$HASH 形式的文件名按识别出的类型加上扩展名"""
+    if filename[:1] == "$":
+        s = sniff_magic(buf)
+        if s is not None:
+            return f'{filename}.{s}'
+    return filename
+
+def read_prefix(buf, filename):
+    full_filename = os.path.join(outdir, prefixed_name(buf, filename))
     os.makedirs(os.path.dirname(full_filename), exist_ok=True)
     return full_filename
 
@@ -47,6 +71,39 @@ def make_file_id(lp_string):
     # 返回最终的文件 ID
     return (v2 | (v3 << 24)) & 0xFFFFFFFF
 
+def make_file_ids(names, chunk=65536):
+    """
+    批量计算 make_file_id，结果与逐个调用逐位一致。
+    安装了 NumPy 时把等长的名称组成码位矩阵，按字符位置逐列向量化计算；否则退回逐个计算。
+    """
+    names = [name.lower() for name in names]
+    if np is None:
+        return [make_file_id(name) for name in names]
+
+    # 按长度分组，同组内无需填充和掩码，逐列计算即可
+    groups = {}
+    for i, name in enumerate(names):
+        groups.setdefault(len(name), []).append(i)
+
+    ids = [0] * len(names)
+    for width, members in groups.items():
+        if width == 0:
+            continue
+        for start in range(0, len(members), chunk):
+            part = members[start:start + chunk]
+            # UTF-32 码位即 ord() 的值
+            codes = np.frombuffer(''.join(names[i] for i in part).encode('utf-32-le'),
+                                  dtype='<u4').astype(np.uint64).reshape(len(part), width)
+            v3 = codes.sum(axis=1)
+            v2 = np.zeros(len(part), dtype=np.uint64)
+            for col in range(width):
+                v2 = (codes[:, col] + (v2 << np.uint64(8))) & np.uint64(0xFFFFFFFF)
+                over = (v2 & np.uint64(0xFF800000)) != 0
+                v2[over] %= np.uint64(0xFFF9D7)
+            for i, file_id in zip(part, ((v2 | (v3 << np.uint64(24))) & np.uint64(0xFFFFFFFF)).tolist()):
+                ids[i] = file_id
+    return ids
+
 def uncompressCustom(source):
     try:
         # 使用wbits=-15来忽略zlib头
@@ -55,6 +112,22 @@ def uncompressCustom(source):
         print(f"Error decompressing data: {e}")
         return None
     
+def iter_inflate(source, chunk_size=1 << 20):
+    """流式解压原始 deflate 数据，逐块产出，任何时刻最多只持有 chunk_size 字节的解压结果"""
+    d = zlib.decompressobj(-15)
+    data = source
+    # 流结束后尾部的 Adler-32 会留在 unconsumed_tail 中，需以 eof 为准结束循环
+    while data and not d.eof:
+        chunk = d.decompress(data, chunk_size)
+        if chunk:
+            yield chunk
+        data = d.unconsumed_tail
+    chunk = d.flush()
+    if chunk:
+        yield chunk
+    if not d.eof:
+        raise zlib.error("deflate 数据不完整")
+
 def read_int(f, address=None):
     if address is not None:
         f.seek(address)
@@ -78,86 +151,820 @@ def read_null_terminated_string(file, encoding='shift-jis'):
             chars.append(char)
     return b''.join(chars).decode(encoding)
 
-def unpack(input):
-    未压缩 = []
-    log= []
-
-    with open(input, 'rb') as f:
-        IdxQ = read_int(f,4)
-        f.seek(0x10)
-        idx = []
-        for i in range(IdxQ):
-            hash = read_int(f)
-            offset = read_int(f)
-
-            size = read_int(f)
-            if hash == 0:
-                print(i)
-                break
-            
-            idx.append((hash, offset, size))
-        f.close()
-    
-    for hash, offset, size in idx:
-        # 计算对应的.p0X文件名和偏移量
-        fnum = offset >> 28  # 右移27位，对应C代码的 >>0x1B
-        foff = offset & 0xFFFFFFF  # 计算实际偏移
+class NameIndex:
+    """
+    list.txt 的 hash→文件名 索引。
+    首次使用时计算所有文件名的 hash，缓存为 list.txt.cache（有序 uint32 hash 数组 + 偏移表 + 名称区），
+    之后直接 mmap 缓存并二分查找；list.txt 的大小/修改时间变化且内容 sha1 不同时自动重建。
+    """
 
-        p_file = f"{os.path.splitext(input)[0]}.p{fnum:02d}"  # 生成文件名如.p00, .p01
+    MAGIC = b'LSTC'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQ20sI')  # magic, version, 源文件大小, 源文件 mtime_ns, 源文件 sha1, 条目数
 
+    def __init__(self, hashes, offsets, blob, buffer=None):
+        self._hashes = hashes
+        self._offsets = offsets
+        self._blob = blob
+        self._buffer = buffer
+
+    @classmethod
+    def load(cls, list_path='list.txt', cache_path=None):
+        cache_path = cache_path or list_path + '.cache'
+        st = os.stat(list_path)
+        index = cls._open_cache(cache_path, st, list_path)
+        if index is not None:
+            return index
+
+        with open(list_path, 'rb') as f:
+            source = f.read()
+        data = cls._build(io.StringIO(source.decode('utf-8'), newline=None), st, hashlib.sha1(source).digest())
         try:
-            with open(p_file, 'rb') as f:
-                f.seek(foff)
-                p_data = f.read(size)
-        except FileNotFoundError:
-            print(f"Error: {p_file} not found, skipping entry.")
-            continue
+            with open(cache_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            print(f"警告: 无法写入名称缓存 {cache_path}: {e}")
+        return cls._from_buffer(data)
+
+    @classmethod
+    def _open_cache(cls, cache_path, st, list_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                header = f.read(cls.HEADER.size)
+                if len(header) < cls.HEADER.size:
+                    return None
+                magic, version, size, mtime_ns, sha1, count = cls.HEADER.unpack(header)
+                if magic != cls.MAGIC or version != cls.VERSION:
+                    return None
+                if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    # 修改时间变了但内容可能没变，比对内容 hash
+                    with open(list_path, 'rb') as src:
+                        if hashlib.sha1(src.read()).digest() != sha1:
+                            return None
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        return cls._from_buffer(buffer)
+
+    @classmethod
+    def _build(cls, lines, st, sha1):
+        cleaned_lines = [line for line in (line.strip().rsplit('+', 1)[-1] for line in lines) if line]
+        names = dict(zip(make_file_ids(cleaned_lines), cleaned_lines))
+
+        hashes = array('I', sorted(names))
+        offsets = array('I', [0])
+        blob = bytearray()
+        for hash in hashes:
+            blob.extend(names[hash].encode('utf-8'))
+            offsets.append(len(blob))
+        if sys.byteorder != 'little':
+            hashes.byteswap()
+            offsets.byteswap()
+
+        return b''.join((cls.HEADER.pack(cls.MAGIC, cls.VERSION, st.st_size, st.st_mtime_ns, sha1, len(hashes)),
+                         hashes.tobytes(), offsets.tobytes(), bytes(blob)))
 
-        if hash in name_dict:
-            filename = name_dict[hash]
+    @classmethod
+    def _from_buffer(cls, buffer):
+        count = cls.HEADER.unpack_from(buffer)[-1]
+        view = memoryview(buffer)
+        start = cls.HEADER.size
+        hashes = view[start:start + count * 4]
+        offsets = view[start + count * 4:start + count * 8 + 4]
+        blob = view[start + count * 8 + 4:]
+        if sys.byteorder == 'little':
+            hashes, offsets = hashes.cast('I'), offsets.cast('I')
         else:
-            filename = f"${hex(hash)[2:].upper()}"
+            hashes, offsets = array('I', hashes), array('I', offsets)
+            hashes.byteswap()
+            offsets.byteswap()
+        return cls(hashes, offsets, blob, buffer)
+
+    def _find(self, hash):
+        i = bisect_left(self._hashes, hash)
+        if i < len(self._hashes) and self._hashes[i] == hash:
+            return i
+        return -1
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, hash):
+        return self._find(hash) >= 0
+
+    def __getitem__(self, hash):
+        i = self._find(hash)
+        if i < 0:
+            raise KeyError(hash)
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def get(self, hash, default=None):
+        try:
+            return self[hash]
+        except KeyError:
+            return default
+
+    def items(self):
+        for i, hash in enumerate(self._hashes):
+            yield hash, bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+class IPFBArchive:
+    """IPFB 封包读取器：索引表只解析一次，每个 .pNN 分卷只 mmap 一次"""
+
+    ENTRY = struct.Struct('>III')  # hash, offset, size
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._hashes = None
+        self._sorted = None
+        self._volumes = {}
+        # verify/unpack 的工作线程会并发打开分卷
+        self._lock = threading.Lock()
+
+        with open(path, 'rb') as f:
+            header = f.read(0x10)
+            count = int.from_bytes(header[4:8], 'big')
+            table = f.read(count * 12)
+        self._table = table[:len(table) // 12 * 12]
+        # 头部记录的条目数，索引末尾可能有 hash 为 0 的填充条目
+        self.rows = len(self._table) // 12
+
+    @property
+    def hashes(self):
+        """有效条目的 hash 列 (array)，遇到 hash 为 0 的条目即视为索引结束"""
+        if self._hashes is None:
+            hashes = array('I', self._table)[0::3]
+            if sys.byteorder == 'little':
+                hashes.byteswap()
+            try:
+                del hashes[hashes.index(0):]
+            except ValueError:
+                pass
+            self._hashes = hashes
+        return self._hashes
+
+    @property
+    def entries(self):
+        """(hash, offset, size) 列表，首次访问时才解析，不含 hash 为 0 的填充条目及其后的部分"""
+        if self._entries is None:
+            self._entries = list(self.ENTRY.iter_unpack(self._table[:len(self.hashes) * 12]))
+        return self._entries
+
+    def find(self, hash):
+        """
+        按 hash 查找条目，返回 (hash, offset, size) 或 None。
+        pack.pack 按 hash 升序写索引，因此在有效条目的 hash 列上二分查找；只有索引确实无序时才顺序查找。
+        """
+        hashes = self.hashes
+        if self._sorted is None:
+            self._sorted = hashes.tolist() == sorted(hashes)
+        if self._sorted:
+            i = bisect_left(hashes, hash)
+            if i == len(hashes) or hashes[i] != hash:
+                return None
+        else:
+            try:
+                i = hashes.index(hash)
+            except ValueError:
+                return None
+        return self.ENTRY.unpack_from(self._table, i * 12)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def volume_path(self, fnum):
+        return f"{os.path.splitext(self.path)[0]}.p{fnum:02d}"  # 生成文件名如.p00, .p01
+
+    def volume(self, fnum):
+        """返回分卷的 mmap（空文件返回 b''），分卷不存在时返回 None；可在多个线程中调用"""
+        vol = self._volumes.get(fnum, False)
+        if vol is not False:
+            return vol
+        with self._lock:
+            if fnum not in self._volumes:
+                try:
+                    with open(self.volume_path(fnum), 'rb') as f:
+                        if os.fstat(f.fileno()).st_size == 0:
+                            self._volumes[fnum] = b''
+                        else:
+                            self._volumes[fnum] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except FileNotFoundError:
+                    self._volumes[fnum] = None
+            return self._volumes[fnum]
+
+    def read(self, offset, size):
+        """按索引中的 offset/size 返回零拷贝的 memoryview，分卷不存在时返回 None"""
+        fnum = offset >> 28  # 高 4 位为分卷号
+        foff = offset & 0xFFFFFFF  # 计算实际偏移
+        vol = self.volume(fnum)
+        if vol is None:
+            return None
+        return memoryview(vol)[foff:foff + size]
+
+    def close(self):
+        with self._lock:
+            for vol in self._volumes.values():
+                if isinstance(vol, mmap.mmap):
+                    try:
+                        vol.close()
+                    except BufferError:
+                        # 仍有 memoryview 引用该分卷，交给垃圾回收处理
+                        pass
+            self._volumes.clear()
+
+class IndexSidecar:
+    """
+    封包索引的旁路文件 (<封包>.idx)，一次读取即可得到完整列表，无需打开分卷。
+    文件头记录封包的大小和修改时间，之后每个条目 7 个 uint32（小端）：
+    hash, 分卷号, 卷内偏移, 大小, 标志 (1 = Z1 压缩), 原始大小, 名称偏移 (无名称时为 0xFFFFFFFF)，
+    最后是以 NUL 结尾的 UTF-8 名称区。
+    """
+
+    MAGIC = b'IPFX'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQII')  # magic, version, 封包大小, 封包 mtime_ns, 条目数, 保留
+    FIELDS = 7
+    NO_NAME = 0xFFFFFFFF
+
+    def __init__(self, records, names):
+        self._records = records
+        self._names = names
+
+    @staticmethod
+    def path_for(archive_path):
+        return f'{os.path.splitext(archive_path)[0]}.idx'
+
+    @classmethod
+    def build(cls, archive, names):
+        """从已打开的封包生成，names 为 hash→文件名 的映射（如 NameIndex）"""
+        records = array('I')
+        blob = bytearray()
+        for hash, offset, size in archive.entries:
+            usize, flags = size, 0
+            p_data = archive.read(offset, min(size, 12))
+            if p_data is not None:
+                with p_data:
+                    if p_data[:2] == b'Z1' and len(p_data) >= 6:
+                        usize, flags = struct.unpack_from('>I', p_data, 2)[0], 1
+            name = names.get(hash)
+            name_offset = cls.NO_NAME
+            if name is not None:
+                name_offset = len(blob)
+                blob.extend(name.encode('utf-8') + b'\x00')
+            records.extend((hash, offset >> 28, offset & 0xFFFFFFF, size, flags, usize, name_offset))
+        return cls(records, bytes(blob))
+
+    def write(self, archive_path):
+        st = os.stat(archive_path)
+        records = array('I', self._records)
+        if sys.byteorder != 'little':
+            records.byteswap()
+        path = self.path_for(archive_path)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, st.st_size, st.st_mtime_ns,
+                                     len(self._records) // self.FIELDS, 0))
+            f.write(records.tobytes())
+            f.write(self._names)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, archive_path):
+        """读取旁路文件，不存在或与封包不匹配时返回 None"""
+        try:
+            st = os.stat(archive_path)
+            with open(cls.path_for(archive_path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, version, size, mtime_ns, count, _ = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION or (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+            return None
+        end = cls.HEADER.size + count * cls.FIELDS * 4
+        records = array('I', data[cls.HEADER.size:end])
+        if sys.byteorder != 'little':
+            records.byteswap()
+        return cls(records, data[end:])
+
+    def __len__(self):
+        return len(self._records) // self.FIELDS
+
+    def __iter__(self):
+        """产出 (hash, 分卷号, 卷内偏移, 大小, 是否压缩, 原始大小, 名称或 None)"""
+        records = self._records
+        for i in range(0, len(records), self.FIELDS):
+            hash, volume, offset, size, flags, usize, name_offset = records[i:i + self.FIELDS]
+            name = None
+            if name_offset != self.NO_NAME:
+                name = self._names[name_offset:self._names.index(b'\x00', name_offset)].decode('utf-8')
+            yield hash, volume, offset, size, bool(flags & 1), usize, name
+
+def write_index_sidecar(archive_path, names):
+    """生成或更新 <封包>.idx，写入失败（如目录只读）时只给出警告"""
+    try:
+        with IPFBArchive(archive_path) as archive:
+            sidecar = IndexSidecar.build(archive, names)
+        sidecar.write(archive_path)
+    except OSError as e:
+        print(f"警告: 无法写入索引文件 {IndexSidecar.path_for(archive_path)}: {e}")
+        return None
+    return sidecar
+
+class LineLog:
+    """逐行追加的文本日志，首次写入时才创建文件，按批次刷新到磁盘"""
+
+    def __init__(self, path, batch=256):
+        self.path = path
+        self.batch = batch
+        self._lines = []
+        self._file = None
+
+    def write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self.batch:
+            self.flush()
 
-        log.append((filename, hash, offset, size))
+    def flush(self):
+        if not self._lines:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(''.join(self._lines))
+        self._file.flush()
+        self._lines.clear()
 
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_manifest(path, log):
+    """输出 JSON Lines 格式的条目清单，每行一个条目"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, (file, hash, offset, size, compressed) in enumerate(log):
+            f.write(json.dumps({'index': i, 'name': file, 'hash': hash, 'offset': offset,
+                                'size': size, 'compressed': compressed}, ensure_ascii=False))
+            f.write('\n')
+
+def file_id_from_name(name):
+    """把 list.txt 中的文件名（可带 "xxx.pak+" 前缀）或 $HASH 形式的名称转换为 hash"""
+    name = name.rsplit('+', 1)[-1]
+    if name[:1] == '$':
+        return int(os.path.splitext(name[1:])[0], 16)
+    return make_file_id(name)
+
+def peek_entry(p_data, size=4):
+    """只解压条目开头的 size 个字节，用于识别类型"""
+    if p_data[:2] != b'Z1':
+        return bytes(p_data[:size])
+    try:
+        return zlib.decompressobj(-15).decompress(p_data[12:], size)
+    except zlib.error:
+        return b''
+
+class EntryFilter:
+    """
+    按文件名和类型筛选要解包的条目。
+    include/exclude 为 glob 模式（不区分大小写），以 "re:" 开头时按正则表达式匹配；
+    $HASH 条目按识别出类型后的文件名（如 $1234ABCD.IXUD）匹配。magic 为要保留的类型列表（如 IXUD）。
+    """
+
+    def __init__(self, include=(), exclude=(), magic=()):
+        self.include = [self._compile(pattern) for pattern in include]
+        self.exclude = [self._compile(pattern) for pattern in exclude]
+        self.magic = {m.upper() for m in magic}
+
+    @staticmethod
+    def _compile(pattern):
+        if pattern.startswith('re:'):
+            return re.compile(pattern[3:], re.IGNORECASE)
+        return re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.magic)
+
+    def match(self, filename, p_data):
+        """只在需要时解压条目开头的几个字节"""
+        head = None
+        if self.magic or filename[:1] == '$':
+            head = peek_entry(p_data)
+        if self.magic and (sniff_magic(head) or '').upper() not in self.magic:
+            return False
+
+        name = prefixed_name(head, filename)
+        if self.include and not any(pattern.match(name) for pattern in self.include):
+            return False
+        return not any(pattern.match(name) for pattern in self.exclude)
+
+def decode_entry(p_data):
+    """返回条目的原始数据，Z1 压缩的条目会被解压"""
+    if p_data[:2] == b'Z1':
+        return uncompressCustom(p_data[12:])
+    return p_data
+
+def get_entry(input, name):
+    """从封包中只读取并解压一个条目，返回 bytes；找不到时返回 None"""
+    with IPFBArchive(input) as archive:
+        entry = archive.find(file_id_from_name(name))
+        if entry is None:
+            return None
+        p_data = archive.read(entry[1], entry[2])
+        if p_data is None:
+            return None
+        with p_data:
+            data = decode_entry(p_data)
+            return None if data is None else bytes(data)
+
+def check_entry(archive, entry):
+    """检查单个条目：分卷存在、索引范围不越界；Z1 条目还会流式解压并核对大小和 Adler-32。返回问题描述，正常时返回 None"""
+    hash, offset, size = entry
+    vol = archive.volume(offset >> 28)
+    if vol is None:
+        return f"分卷 {archive.volume_path(offset >> 28)} 不存在"
+    foff = offset & 0xFFFFFFF
+    if foff + size > len(vol):
+        return f"索引越界: 0x{foff:X}+0x{size:X} > 分卷大小 0x{len(vol):X}"
+
+    with archive.read(offset, size) as p_data:
         if p_data[:2] != b'Z1':
-            未压缩.append(filename)
+            return None
+        if size < 12:
+            return "Z1 头不完整"
+        expected_size, expected_adler = struct.unpack_from('>II', p_data, 2)
+        length = 0
+        adler = 1
+        try:
+            for chunk in iter_inflate(p_data[12:]):
+                length += len(chunk)
+                adler = zlib.adler32(chunk, adler)
+        except zlib.error as e:
+            return f"解压失败: {e}"
+    if length != expected_size:
+        return f"大小不符: 头部 0x{expected_size:X}, 实际 0x{length:X}"
+    if adler != expected_adler:
+        return f"Adler-32 不符: 头部 {expected_adler:08X}, 实际 {adler:08X}"
+    return None
+
+def verify(input, jobs=1):
+    """校验封包中的所有条目，不写出任何文件。返回 [(序号, hash, 问题描述)]"""
+    with IPFBArchive(input) as archive, ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        results = pool.map(lambda entry: check_entry(archive, entry), archive.entries)
+        return [(i, entry[0], problem)
+                for i, (entry, problem) in enumerate(zip(archive.entries, results)) if problem]
+
+def entry_fingerprint(archive, entry):
+    """
+    不解压即可比较的条目指纹 (原始大小, Adler-32)：Z1 条目直接取头部记录的值，未压缩条目对原始数据计算 Adler-32。
+    分卷缺失或越界时返回 None。
+    """
+    hash, offset, size = entry
+    p_data = archive.read(offset, size)
+    if p_data is None or len(p_data) != size:
+        return None
+    with p_data:
+        if p_data[:2] == b'Z1' and size >= 12:
+            return struct.unpack_from('>II', p_data, 2)
+        return size, zlib.adler32(p_data)
+
+def diff_archives(old, new):
+    """
+    按 hash 对比两个已打开的封包，返回 (新增, 删除, 变化, 问题) 四个列表，前三个为 hash 列表，
+    问题为 (hash, 说明) 列表，记录分卷缺失或越界、无法比较的条目。
+    先比较指纹 (原始大小, Adler-32)，只有两边都是未压缩条目且指纹相同时才逐字节比较；Z1 条目不必读取整个数据块。
+    """
+    old_entries = {entry[0]: entry for entry in old.entries}
+    new_entries = {entry[0]: entry for entry in new.entries}
+    added = sorted(new_entries.keys() - old_entries.keys())
+    removed = sorted(old_entries.keys() - new_entries.keys())
+    changed = []
+    problems = []
+    for hash in sorted(old_entries.keys() & new_entries.keys()):
+        a, b = old_entries[hash], new_entries[hash]
+        old_fingerprint = entry_fingerprint(old, a)
+        new_fingerprint = entry_fingerprint(new, b)
+        if old_fingerprint is None or new_fingerprint is None:
+            side = "旧" if old_fingerprint is None else "新"
+            problems.append((hash, f"{side}封包的分卷缺失或条目越界"))
+            continue
+        if old_fingerprint != new_fingerprint:
+            changed.append(hash)
+            continue
+        # Adler-32 可能碰撞，未压缩条目已读过全部数据，再逐字节确认一次
+        with old.read(a[1], a[2]) as old_data, new.read(b[1], b[2]) as new_data:
+            if old_data[:2] != b'Z1' and new_data[:2] != b'Z1' and old_data != new_data:
+                changed.append(hash)
+    return added, removed, changed, problems
+
+STREAM_THRESHOLD = 16 << 20
+
+class Journal:
+    """
+    解包进度日志，中断后可配合 --resume 继续。
+    第一行记录封包的大小和修改时间（封包变化后旧日志作废），之后每写完一个条目追加一行 "序号 大小 Adler-32 路径"。
+    解包完整结束且没有条目失败时由 unpack 删除。
+    """
+
+    def __init__(self, path, archive_path, resume=False):
+        st = os.stat(archive_path)
+        header = f"IPFB-JOURNAL {st.st_size} {st.st_mtime_ns}\n"
+        self.path = path
+        self.failed = 0
+        self.done = {}
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                if f.readline() == header:
+                    for line in f:
+                        parts = line.rstrip('\n').split(' ', 3)
+                        if len(parts) == 4:
+                            self.done[int(parts[0])] = (int(parts[1]), int(parts[2], 16), parts[3])
+
+        if self.done:
+            self._file = open(path, 'a', encoding='utf-8')
         else:
-            p_data = uncompressCustom(p_data[12:])
+            self._file = open(path, 'w', encoding='utf-8')
+            self._file.write(header)
+            self._file.flush()
+
+    def completed(self, index):
+        """条目此前已完整写出且磁盘上的文件大小和 Adler-32 都与记录一致"""
+        if index not in self.done:
+            return False
+        size, adler, path = self.done[index]
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            checksum = 1
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    checksum = zlib.adler32(chunk, checksum)
+        except OSError:
+            return False
+        return checksum == adler
+
+    def record(self, index, result):
+        if result is None:
+            self.failed += 1
+            return
+        path, size, adler = result
+        self._file.write(f"{index} {size} {adler:08X} {path}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def extract_entry(p_data, filename, stream_threshold=STREAM_THRESHOLD):
+    """
+    解压单个条目并写入输出目录，可在线程池中并发调用（zlib 解压时会释放 GIL）。
+    Z1 头记录的原始大小超过 stream_threshold 时边解压边写出，不在内存中保留完整的解压结果。
+    先写到 .tmp 再改名，中断时不会留下写了一半的文件。返回 (路径, 大小, Adler-32)，解压失败时返回 None。
+    """
+    if p_data[:2] == b'Z1' and len(p_data) >= 12 and struct.unpack_from('>I', p_data, 2)[0] > stream_threshold:
+        chunks = iter_inflate(p_data[12:])
+        tmp = None
+        try:
+            # 文件名可能要根据前 4 字节确定，先解出第一块
+            first = next(chunks, b'')
+            filename = read_prefix(first, filename)
+            size = len(first)
+            adler = zlib.adler32(first)
+            tmp = filename + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(first)
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    adler = zlib.adler32(chunk, adler)
+        except zlib.error as e:
+            print(f"Error decompressing data: {e}")
+            # 不留下写了一半的 .tmp，否则会被当作普通文件重新打包
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        os.replace(tmp, filename)
+        return filename, size, adler
+
+    p_data = decode_entry(p_data)
+    if p_data is None:
+        return None
+
+    filename = read_prefix(p_data, filename)
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(p_data)
+    os.replace(filename + '.tmp', filename)
+    return filename, len(p_data), zlib.adler32(p_data)
+
+def unpack(input, jobs=1, manifest=None, stream_threshold=STREAM_THRESHOLD, resume=False, entry_filter=None):
+    log = []
+
+    with IPFBArchive(input) as archive, ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool, \
+            LineLog('unpack.log') as log_file, \
+            LineLog(os.path.join(outdir, 'Non-compression-list.txt')) as 未压缩, \
+            Journal(os.path.abspath(outdir) + '.journal', input, resume) as journal:
+        # 限制同时在途的条目数量，避免解压结果在内存中堆积
+        pending = deque()
+        if len(archive.entries) < archive.rows:
+            # 与原先一致：输出索引中第一个 hash 为 0 的条目序号
+            print(len(archive.entries))
+        for index, (hash, offset, size) in enumerate(archive.entries):
+            p_data = archive.read(offset, size)
+            if p_data is None:
+                print(f"Error: {archive.volume_path(offset >> 28)} not found, skipping entry.")
+                # 记为失败以保留进度日志，补回分卷后 --resume 只需重试这些条目
+                journal.record(index, None)
+                continue
+
+            if hash in name_dict:
+                filename = name_dict[hash]
+            else:
+                filename = f"${hex(hash)[2:].upper()}"
+
+            compressed = p_data[:2] == b'Z1'
+            log_file.write(f"{format(hash, 'X')} {format(offset, 'X')} {format(size, 'X')} {filename}\n")
+            if manifest:
+                log.append((filename, hash, offset, size, compressed))
+
+            # 不符合筛选条件的条目不读取也不解压
+            if entry_filter and not entry_filter.match(filename, p_data):
+                p_data = None
+                continue
+
+            if not compressed:
+                未压缩.write(f'{filename}\n')
+
+            if resume and journal.completed(index):
+                p_data = None
+                continue
+
+            print(filename)
+
+            if jobs > 1:
+                pending.append((index, pool.submit(extract_entry, p_data, filename, stream_threshold)))
+                if len(pending) >= jobs * 4:
+                    index, future = pending.popleft()
+                    journal.record(index, future.result())
+            else:
+                journal.record(index, extract_entry(p_data, filename, stream_threshold))
+            p_data = None
+
+        while pending:
+            index, future = pending.popleft()
+            journal.record(index, future.result())
+
+    # 全部写出后不再需要进度日志；有条目失败时保留，供 --resume 只重试失败的条目
+    if not journal.failed:
+        os.remove(journal.path)
+
+    if manifest:
+        write_manifest(manifest, log)
+    if IndexSidecar.load(input) is None:
+        write_index_sidecar(input, name_dict)
+
+def main_unpack(argv):
+    global name_dict, outdir
+
+    parser = argparse.ArgumentParser(description="解包 IPFB (.pak + .pNN) 封包。其他命令: get, verify, diff, list")
+    parser.add_argument("input", help="输入文件/目录")
+    parser.add_argument("outdir", help="输出目录")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并发解压/写出的线程数 (默认 1)。")
+    parser.add_argument("--manifest", help="解包结束后输出 JSON Lines 格式的条目清单到该路径。")
+    parser.add_argument("--stream-threshold", type=int, default=STREAM_THRESHOLD,
+                        help=f"原始大小超过该字节数的条目边解压边写出 (默认 {STREAM_THRESHOLD})。")
+    parser.add_argument("--resume", action="store_true",
+                        help="根据 <输出目录>.journal 跳过上次已完整写出的条目，继续中断的解包。")
+    parser.add_argument("--include", action="append", default=[],
+                        help="只解包文件名匹配该 glob 模式的条目，以 re: 开头时为正则表达式；可重复指定。")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="跳过文件名匹配该 glob 模式的条目，以 re: 开头时为正则表达式；可重复指定。")
+    parser.add_argument("--magic", action="append", default=[],
+                        help="只解包前 4 字节识别为该类型 (如 IXUD) 的条目；可重复指定。")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    name_dict = NameIndex.load('list.txt')
+    outdir = args.outdir
+    unpack(args.input, args.jobs, args.manifest, args.stream_threshold, args.resume,
+           EntryFilter(args.include, args.exclude, args.magic))
+
+def main_get(argv):
+    parser = argparse.ArgumentParser(prog="unpack.py get", description="从封包中提取单个条目。")
+    parser.add_argument("input", help="输入封包 (.pak)")
+    parser.add_argument("name", help="list.txt 中的文件名或 $HASH")
+    parser.add_argument("-o", "--output", help="输出文件 (默认写到标准输出)")
+    args = parser.parse_args(argv)
+
+    data = get_entry(args.input, args.name)
+    if data is None:
+        print(f"错误: {args.input} 中找不到 {args.name}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+
+def main_verify(argv):
+    parser = argparse.ArgumentParser(prog="unpack.py verify", description="校验封包中的所有条目，不写出任何文件。")
+    parser.add_argument("input", help="输入封包 (.pak)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并发校验的线程数 (默认 1)。")
+    args = parser.parse_args(argv)
+
+    names = NameIndex.load('list.txt') if os.path.exists('list.txt') else {}
+    problems = verify(args.input, args.jobs)
+    for i, hash, problem in problems:
+        print(f"{i} {format(hash, 'X')} {names.get(hash, f'${hash:X}')}: {problem}")
+
+    if problems:
+        print(f"{args.input}: {len(problems)} 个条目损坏")
+        sys.exit(1)
+    print(f"{args.input}: 校验通过")
 
-        print(filename)
+def main_diff(argv):
+    global name_dict, outdir
 
+    parser = argparse.ArgumentParser(prog="unpack.py diff", description="按 hash 对比两个封包的索引和条目校验值。")
+    parser.add_argument("old", help="旧封包 (.pak)")
+    parser.add_argument("new", help="新封包 (.pak)")
+    parser.add_argument("-o", "--outdir", help="把新封包中新增和变化的条目解包到该目录")
+    args = parser.parse_args(argv)
 
-        filename = read_prefix(p_data, filename)
-        with open(filename, 'wb') as f:
-                f.write(p_data)
-        f.close()
+    name_dict = NameIndex.load('list.txt') if os.path.exists('list.txt') else {}
+    with IPFBArchive(args.old) as old, IPFBArchive(args.new) as new:
+        added, removed, changed, problems = diff_archives(old, new)
+        for mark, hashes in (('+', added), ('-', removed), ('M', changed)):
+            for hash in hashes:
+                print(f"{mark} {format(hash, 'X')} {name_dict.get(hash, f'${hash:X}')}")
+        for hash, problem in problems:
+            print(f"! {format(hash, 'X')} {name_dict.get(hash, f'${hash:X}')}: {problem}")
+        print(f"新增 {len(added)}，删除 {len(removed)}，变化 {len(changed)}，无法比较 {len(problems)}")
 
-        if len(未压缩) > 0:
-            with open(os.path.join(outdir, 'Non-compression-list.txt'), 'w') as f:
-                for i in 未压缩:
-                    f.write(f'{i}\n')
+        if args.outdir:
+            os.makedirs(args.outdir, exist_ok=True)
+            outdir = args.outdir
+            for hash in added + changed:
+                hash, offset, size = new.find(hash)
+                p_data = new.read(offset, size)
+                if p_data is not None:
+                    extract_entry(p_data, name_dict.get(hash, f"${hex(hash)[2:].upper()}"))
+                    p_data = None
 
-        with open('unpack.log', 'w') as f:
-            for file, hash, offset, size in log:
-                f.write(f"{format(hash, 'X')} {format(offset, 'X')} {format(size, 'X')} {file}\n")
+    if problems:
+        sys.exit(1)
 
+def main_list(argv):
+    parser = argparse.ArgumentParser(prog="unpack.py list", description="列出封包中的条目 (优先使用 <封包>.idx)。")
+    parser.add_argument("input", help="输入封包 (.pak)")
+    parser.add_argument("--rebuild", action="store_true", help="忽略已有的 .idx，重新从封包生成。")
+    args = parser.parse_args(argv)
 
+    sidecar = None if args.rebuild else IndexSidecar.load(args.input)
+    if sidecar is None:
+        names = NameIndex.load('list.txt') if os.path.exists('list.txt') else {}
+        sidecar = write_index_sidecar(args.input, names)
+        if sidecar is None:
+            with IPFBArchive(args.input) as archive:
+                sidecar = IndexSidecar.build(archive, names)
 
-            
+    lines = []
+    for hash, volume, offset, size, compressed, usize, name in sidecar:
+        lines.append(f"{hash:08X} {volume:02d} {offset:08X} {size:08X} {'Z' if compressed else '-'} {usize:08X} "
+                     f"{name if name is not None else f'${hash:X}'}\n")
+    sys.stdout.write(''.join(lines))
 
+COMMANDS = {
+    'get': main_get,
+    'verify': main_verify,
+    'diff': main_diff,
+    'list': main_list,
+}
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("用法: <输入文件/目录> <输出目录>")
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
     else:
-        os.makedirs(sys.argv[2], exist_ok=True)
-        name_dict = {}
-        with open('list.txt', 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                cleaned_line = line.strip().rsplit('+', 1)[-1]
-                if cleaned_line: 
-                    name_dict[make_file_id(cleaned_line)] = cleaned_line
-        outdir = sys.argv[2]
-        unpack(sys.argv[1])
- 
\ No newline at end of file
+        main_unpack(sys.argv[1:])